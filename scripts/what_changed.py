@@ -6,28 +6,230 @@
 
 # A script to set labels on pull-rquests based on files being changed
 
+import collections
+import io
+import json
 import sys
 import re, os
 import subprocess
 import argparse
 import shlex
-from github import Github
 
 if "ZEPHYR_BASE" not in os.environ:
     exit(1)
 
+# Pull requests that would get more labels than this are left alone
+MAX_LABELS = 10
 
-def git(*args):
-    # Helper for running a Git command. Returns the rstrip()ed stdout output.
-    # Called like git("diff"). Exits with SystemError (raised by sys.exit()) on
-    # errors.
+# Timeout in seconds for requests to the GitHub API
+GITHUB_TIMEOUT = 30
+
+# Area rules, matched against the paths of the changed files. Each entry in
+# the table is (area, patterns, labels): the labels are applied if any
+# pattern matches the start of a changed path. Patterns are written as
+# regexes, but only these forms are supported (see _split_patterns()):
+#
+#   ^<literal>     Path starts with <literal>. Directories end in '/'.
+#   .*<literal>$   Path ends with <literal>
+#   .*<literal>.*  Path contains <literal>
+#
+# <literal> may escape punctuation, as in '\.'.
+#
+# The table is stored as the parallel tuples RULE_AREAS, RULE_PATTERNS, and
+# RULE_LABELS. A rule is referred to by its index in them. The patterns
+# aren't compiled here. They're only split up and turned into the lookup
+# tables below.
+RULE_AREAS, RULE_PATTERNS, RULE_LABELS = zip(
+    ("Modem", ["^drivers/modem/"], ["area: Modem"]),
+    ("PWM", ["^drivers/pwm/"], ["area: PWM"]),
+    ("C Library", ["^lib/libc/"], ["area: C Library"]),
+    ("DTS", ["^dts/", r".*\.dts$"], ["area: Device Tree"]),
+    ("Watchdog", ["^drivers/watchdog/"], ["area: Watchdog"]),
+    ("Sensors", ["^drivers/sensor/"], ["area: Sensors"]),
+    ("ADC", ["^drivers/adc/"], ["area: ADC"]),
+    ("Counter", ["^drivers/counter/"], ["area: Counter"]),
+    ("Timer", ["^drivers/timer/"], ["area: Timer"]),
+    ("I2S", ["^drivers/i2s/"], ["area: I2S"]),
+    ("I2C", ["^drivers/i2c/"], ["area: I2C"]),
+    ("SPI", ["^drivers/spi/"], ["area: SPI"]),
+    ("Boards", ["^boards/"], ["area: Boards"]),
+    ("POSIX", ["^lib/posix/"], ["area: POSIX"]),
+    ("Native Port", ["^arch/posix/", "^soc/posix/", ".*native_posix.*"],
+     ["area: native port"]),
+    ("X86", ["^arch/x86/"], ["area: X86"]),
+    ("ARM", ["^arch/arm/"], ["area: ARM"]),
+    ("Nios2", ["^arch/nios2/"], ["area: NIOS2"]),
+    ("Xtensa", ["^arch/xtensa/"], ["area: Xtensa"]),
+    ("RISCv32", ["^arch/riscv32/"], ["area: RISCv32"]),
+    ("ARC", ["^arch/arc/"], ["area: ARC"]),
+    ("Networking", ["^subsys/net/", "^samples/net/", "^tests/net/"],
+     ["area: Networking"]),
+    ("Logging", ["^subsys/logging/"], ["area: Logging"]),
+    ("Shell", ["^subsys/shell/"], ["area: Shell"]),
+    ("Console", ["^subsys/console/"], ["area: Console"]),
+    ("Testsuite", ["^subsys/testsuite/"], ["area: Testing Suite"]),
+    ("Settings", ["^subsys/settings/"], ["area: Settings"]),
+    ("File System", ["^subsys/fs/"], ["area: File System"]),
+    ("Storage", ["^subsys/storage/"], ["area: Storage"]),
+    ("Bluetooth Mesh", ["^subsys/bluetooth/mesh/"],
+     ["area: Bluetooth Mesh"]),
+    ("Bluetooth", ["^subsys/bluetooth/", ".*bluetooth.*"],
+     ["area: Bluetooth"]),
+    ("API", ["^include/"], ["area: API"]),
+    ("Samples", ["^samples/"], ["area: Samples"]),
+    ("Tests", ["^tests/"], ["area: Tests"]),
+    ("Kernel", ["^kernel/", "^tests/kernel/"], ["area: Kernel"]),
+    ("External", ["^ext/"], ["EXT"]),
+    ("Documentation", ["^doc/", r".*\.rst$"], ["area: Documentation"]),
+    ("Build System", ["^cmake/", r"^CMakeLists\.txt"],
+     ["area: Build System"]),
+    ("Kconfig", ["^scripts/kconfig/", "^Kconfig", r"^Kconfig\.zephyr"],
+     ["area: Kconfig"]),
+    ("Sanitycheck", ["^scripts/sanitycheck", "^scripts/sanity_chk/"],
+     ["area: Sanitycheck"]),
+    ("Manifest", [r"^west\.yml"], ["area: Modules"]),
+)
+
+
+def _split_patterns():
+    # Splits the patterns in RULE_PATTERNS by how they get matched. Returns a
+    # (trie, prefix_rules, suffix_rules, substring_rules) tuple:
+    #
+    #   trie:
+    #     Directory patterns ('^' followed by a literal path ending in '/'),
+    #     as nested dicts keyed by (interned) path component. Each value is a
+    #     [rule indices, children] list.
+    #
+    #   prefix_rules:
+    #     Maps each remaining literal prefix ('^<literal>') to the indices of
+    #     its rules
+    #
+    #   suffix_rules:
+    #     Same, for literal suffixes ('.*<literal>$')
+    #
+    #   substring_rules:
+    #     Same, for literal substrings ('.*<literal>.*')
+    #
+    # Raises ValueError for a pattern of any other form, so that a bad table
+    # entry fails at import instead of silently never matching.
+
+    trie = {}
+    prefix_rules = collections.defaultdict(tuple)
+    suffix_rules = collections.defaultdict(tuple)
+    substring_rules = collections.defaultdict(tuple)
+    for i, patterns in enumerate(RULE_PATTERNS):
+        for pattern in patterns:
+            if pattern.startswith("^") and \
+               _literal(pattern[1:]) is not None:
+                literal = _literal(pattern[1:])
+                if literal.endswith("/"):
+                    children = trie
+                    for component in literal[:-1].split("/"):
+                        node = children.setdefault(sys.intern(component),
+                                                   [(), {}])
+                        children = node[1]
+                    node[0] += (i,)
+                else:
+                    prefix_rules[literal] += (i,)
+            elif pattern.startswith(".*") and pattern.endswith("$") and \
+                 _literal(pattern[2:-1]) is not None:
+                suffix_rules[_literal(pattern[2:-1])] += (i,)
+            elif pattern.startswith(".*") and pattern.endswith(".*") and \
+                 _literal(pattern[2:-2]) is not None:
+                substring_rules[_literal(pattern[2:-2])] += (i,)
+            else:
+                raise ValueError(
+                    "unsupported pattern '{}' for area '{}'. Use "
+                    "'^<literal>', '.*<literal>$', or '.*<literal>.*'."
+                    .format(pattern, RULE_AREAS[i]))
+
+    return trie, dict(prefix_rules), dict(suffix_rules), \
+        dict(substring_rules)
+
+
+def _literal(regex):
+    # Returns the string that 'regex' matches if it's a plain literal, with
+    # escapes like '\.' resolved. Returns None if 'regex' uses any regex
+    # syntax besides escaped punctuation.
+
+    # Even indices hold unescaped text, odd indices escaped characters
+    parts = re.split(r"\\(.)", regex)
+    for n, part in enumerate(parts):
+        if n % 2:
+            if part.isalnum() or part == "_":
+                # Special sequence, like \d
+                return None
+        elif set(part) & set(".^$*+?{}[]()|\\"):
+            return None
+
+    return "".join(parts)
+
+
+def _trie_depth(trie):
+    # Returns the number of path components in the longest directory in
+    # 'trie'
+
+    return max((1 + _trie_depth(children) for _, children in trie.values()),
+               default=0)
+
+
+# Most patterns are '^' followed by a literal directory, like
+# '^drivers/modem/'. Those are looked up in TRIE one path component at a
+# time, so a path is classified in a few dict lookups, however many rules
+# there are. A path only needs to be split into TRIE_DEPTH directory
+# components (plus the rest of the path) for the lookup.
+#
+# Literal prefixes that aren't directories (e.g. '^Kconfig', which also
+# covers Kconfig.zephyr) are matched with str.startswith():
+#
+#   PREFIX_RULES:
+#     Maps each literal prefix to the indices of its rules
+#
+#   PREFIXES:
+#     All literal prefixes, for a quick startswith() check
+#
+#   PREFIX_LENGTHS:
+#     The distinct prefix lengths, sorted. A path that passes the
+#     startswith() check is looked up in PREFIX_RULES once per length.
+#
+# Literal suffixes (like '.*\.dts$') and substrings (like '.*bluetooth.*')
+# are matched with str.endswith() and the 'in' operator:
+#
+#   SUFFIX_RULES, SUBSTRING_RULES:
+#     Map each literal suffix or substring to the indices of its rules
+#
+#   SUFFIXES:
+#     All literal suffixes, for a quick endswith() check
+TRIE, PREFIX_RULES, SUFFIX_RULES, SUBSTRING_RULES = _split_patterns()
+TRIE_DEPTH = _trie_depth(TRIE)
+PREFIXES = tuple(PREFIX_RULES)
+PREFIX_LENGTHS = sorted({len(prefix) for prefix in PREFIX_RULES})
+SUFFIXES = tuple(SUFFIX_RULES)
+
+# Environment for running Git. CI runners can have very large environments,
+# which would otherwise get copied into the child process. Git only needs
+# these.
+GIT_ENV = {name: value for name, value in os.environ.items()
+           if name in ("PATH", "HOME", "XDG_CONFIG_HOME", "SYSTEMROOT") or
+              name.startswith("GIT_")}
+
+
+def git_records(*args):
+    # Helper for running a Git command that terminates the records in its
+    # output with NUL, like 'git diff -z'. Generates the records as they are
+    # read, so that large outputs are never held in memory at once. Paths in
+    # -z output are raw, not quoted, and get decoded like os.fsdecode() does.
+    # Called like git_records("diff", "-z"). Exits with SystemError (raised by
+    # sys.exit()) on errors. Git is killed if the caller stops iterating
+    # early.
 
     git_cmd = ("git",) + args
     git_cmd_s = " ".join(shlex.quote(word) for word in git_cmd)  # For errors
 
     try:
         git_process = subprocess.Popen(
-            git_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            git_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=GIT_ENV)
     except FileNotFoundError:
         sys.exit("git executable not found (when running '{}'). Check that "
                  "it's in listed in the PATH environment variable"
@@ -35,12 +237,111 @@ def git(*args):
     except OSError as e:
         sys.exit("failed to run '{}': {}".format(git_cmd_s, e))
 
-    stdout, stderr = git_process.communicate()
+    with git_process:
+        try:
+            # Unterminated record at the end of the previous chunk
+            partial = b""
+            while True:
+                chunk = git_process.stdout.read1(io.DEFAULT_BUFFER_SIZE)
+                if not chunk:
+                    break
+                *records, partial = (partial + chunk).split(b"\0")
+                for record in records:
+                    yield os.fsdecode(record)
+            if partial:
+                yield os.fsdecode(partial)
+        except GeneratorExit:
+            git_process.kill()
+            raise
+
+        # Only read once stdout is exhausted. Git writes little enough to
+        # stderr that it can't fill the pipe and block meanwhile.
+        stderr = git_process.stderr.read()
+
     if git_process.returncode or stderr:
         sys.exit("failed to run '{}': {}".format(
-            git_cmd_s, stdout.decode("utf-8") + stderr.decode("utf-8")))
+            git_cmd_s, stderr.decode("utf-8", "replace")))
+
 
-    return stdout.decode("utf-8").rstrip()
+def repo_labels(repo_name, github_token):
+    # Returns the names of the labels that exist in the GitHub repository
+    # 'repo_name' (e.g. "zephyrproject-rtos/zephyr").
+    #
+    # The label list is cached on disk between runs (see label_cache_path()).
+    # Each page of it is always revalidated with its cached ETag, so that
+    # renamed or deleted labels drop out. GitHub answers 304 Not Modified for
+    # unchanged pages, and those responses don't count against the rate
+    # limit.
+
+    # Imported here since it's slow to import and only needed when posting
+    # labels
+    import requests
+
+    cache_path = label_cache_path(repo_name)
+    pages = load_label_cache(cache_path)
+
+    new_pages = {}
+    url = "https://api.github.com/repos/{}/labels?per_page=100" \
+          .format(repo_name)
+    while url:
+        headers = {"Authorization": "token " + github_token}
+        if url in pages:
+            headers["If-None-Match"] = pages[url]["etag"]
+
+        resp = requests.get(url, headers=headers, timeout=GITHUB_TIMEOUT)
+        if resp.status_code == 304:
+            new_pages[url] = pages[url]
+        else:
+            resp.raise_for_status()
+            new_pages[url] = {
+                "etag": resp.headers.get("ETag", ""),
+                "labels": [label["name"] for label in resp.json()],
+                "next": resp.links.get("next", {}).get("url")}
+
+        url = new_pages[url]["next"]
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(new_pages, f)
+
+    return {name for page in new_pages.values() for name in page["labels"]}
+
+
+def load_label_cache(cache_path):
+    # Returns the label cache in 'cache_path', as a dict that maps the URL of
+    # each page of the label list to a dict with its ETag, label names, and
+    # the URL of the next page. Returns an empty dict if the file is missing
+    # or doesn't have that shape, which makes repo_labels() fetch all pages.
+
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            pages = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(pages, dict):
+        return {}
+
+    for page in pages.values():
+        if not (isinstance(page, dict) and
+                isinstance(page.get("etag"), str) and
+                isinstance(page.get("labels"), list) and
+                all(isinstance(name, str) for name in page["labels"]) and
+                isinstance(page.get("next"), (str, type(None)))):
+            return {}
+
+    return pages
+
+
+def label_cache_path(repo_name):
+    # Returns the path to the label cache file for 'repo_name'. It's put in
+    # $XDG_CACHE_HOME/ci-tools/, which defaults to ~/.cache/ci-tools/.
+
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(cache_dir, "ci-tools",
+                        "labels-{}.json".format(repo_name.replace("/", "-")))
 
 
 def parse_args():
@@ -60,289 +361,87 @@ def main():
     if not args.commits:
         exit(1)
 
-    commit = git("diff","--name-only", args.commits)
-    files = commit.split("\n")
-
-    matches = [
-            {
-                "area": "Modem",
-                "regex" : ["^drivers/modem"],
-                "counter": 0,
-                "labels": ["area: Modem"]
-                },
-            {
-                "area": "PWM",
-                "regex" : ["^drivers/pwm"],
-                "counter": 0,
-                "labels": ["area: PWM"]
-                },
-            {
-                "area": "C Library",
-                "regex" : ["^lib/libc"],
-                "counter": 0,
-                "labels": ["area: C Library"]
-                },
-            {
-                "area": "DTS",
-                "regex" : ["^dts", ".dts"],
-                "counter": 0,
-                "labels": ["area: Device Tree"]
-                },
-            {
-                "area": "Watchdog",
-                "regex" : ["^drivers/watchdog"],
-                "counter": 0,
-                "labels": ["area: Watchdog"]
-                },
-            {
-                "area": "Sensors",
-                "regex" : ["^drivers/sensor"],
-                "counter": 0,
-                "labels": ["area: Sensors"]
-                },
-            {
-                "area": "ADC",
-                "regex" : ["^drivers/adc"],
-                "counter": 0,
-                "labels": ["area: ADC"]
-                },
-            {
-                "area": "Counter",
-                "regex" : ["^drivers/counter"],
-                "counter": 0,
-                "labels": ["area: Counter"]
-                },
-            {
-                "area": "Timer",
-                "regex" : ["^drivers/timer"],
-                "counter": 0,
-                "labels": ["area: Timer"]
-                },
-            {
-                "area": "I2S",
-                "regex" : ["^drivers/i2s"],
-                "counter": 0,
-                "labels": ["area: I2S"]
-                },
-            {
-                "area": "I2C",
-                "regex" : ["^drivers/i2c"],
-                "counter": 0,
-                "labels": ["area: I2C"]
-                },
-            {
-                "area": "SPI",
-                "regex" : ["^drivers/spi"],
-                "counter": 0,
-                "labels": ["area: SPI"]
-                },
-            {
-                "area": "Boards",
-                "regex" : ["^boards/"],
-                "counter": 0,
-                "labels": ["area: Boards"]
-                },
-            {
-                "area": "POSIX",
-                "regex" : ["^lib/posix/"],
-                "counter": 0,
-                "labels": ["area: POSIX"]
-                },
-            {
-                "area": "Native Port",
-                "regex" : ["^arch/posix/", "^soc/posix", ".*native_posix.*"],
-                "counter": 0,
-                "labels": ["area: native port"]
-                },
-            {
-                "area": "X86",
-                "regex" : ["^arch/x86/"],
-                "counter": 0,
-                "labels": ["area: X86"]
-                },
-            {
-                "area": "ARM",
-                "regex" : ["^arch/arm/"],
-                "counter": 0,
-                "labels": ["area: ARM"]
-                },
-            {
-                "area": "Nios2",
-                "regex" : ["^arch/nios2/"],
-                "counter": 0,
-                "labels": ["area: NIOS2"]
-                },
-            {
-                "area": "Xtensa",
-                "regex" : ["^arch/xtensa/"],
-                "counter": 0,
-                "labels": ["area: Xtensa"]
-                },
-            {
-                "area": "RISCv32",
-                "regex" : ["^arch/riscv32/"],
-                "counter": 0,
-                "labels": ["area: RISCv32"]
-                },
-            {
-                "area": "ARC",
-                "regex" : ["^arch/arc"],
-                "counter": 0,
-                "labels": ["area: ARC"]
-                },
-            {
-                "area": "Netowrking",
-                "regex" : ["^subsys/net", "^samples/net/", "^tests/net/"],
-                "counter": 0,
-                "labels": ["area: Networking"]
-                },
-            {
-                "area": "Logging",
-                "regex" : ["^subsys/logging"],
-                "counter": 0,
-                "labels": ["area: Logging"]
-                },
-            {
-                "area": "Shell",
-                "regex" : ["^subsys/shell"],
-                "counter": 0,
-                "labels": ["area: Shell"]
-                },
-            {
-                "area": "Console",
-                "regex" : ["^subsys/console"],
-                "counter": 0,
-                "labels": ["area: Console"]
-                },
-            {
-                "area": "Testsuite",
-                "regex" : ["^subsys/testsuite"],
-                "counter": 0,
-                "labels": ["area: Testing Suite"]
-                },
-            {
-                "area": "Settings",
-                "regex" : ["^subsys/settings"],
-                "counter": 0,
-                "labels": ["area: Settings"]
-                },
-            {
-                "area": "File System",
-                "regex" : ["^subsys/fs"],
-                "counter": 0,
-                "labels": ["area: File System"]
-                },
-            {
-                "area": "Storage",
-                "regex" : ["^subsys/storage"],
-                "counter": 0,
-                "labels": ["area: Storage"]
-                },
-            {
-                "area": "Bluetooth",
-                "regex" : ["^subsys/bluetooth", ".*bluetooth.*"],
-                "counter": 0,
-                "labels": ["area: Bluetooth"]
-                },
-            {
-                "area": "Bluetooth Mesh",
-                "regex" : ["^subsys/bluetooth/mesh"],
-                "counter": 0,
-                "labels": ["area: Bluetooth Mesh"]
-                },
-            {
-                "area": "API",
-                "regex" : ["^include/"],
-                "counter": 0,
-                "labels": ["area: API"]
-                },
-            {
-                "area": "Samples",
-                "regex" : ["^samples/"],
-                "counter": 0,
-                "labels": ["area: Samples"]
-                },
-            {
-                "area": "Tests",
-                "regex" : ["^tests/"],
-                "counter": 0,
-                "labels": ["area: Tests"]
-                },
-            {
-                "area": "Kernel",
-                "regex" : ["^kernel/", "^tests/kernel/"],
-                "counter": 0,
-                "labels": ["area: Kernel"]
-                },
-            {
-                "area": "External",
-                "regex" : ["^ext/"],
-                "counter": 0,
-                "labels": ["EXT"]
-                },
-            {
-                "area": "Documentation",
-                "regex" : ["^doc/", r"\.rst$", r"\.txt$"],
-                "counter": 0,
-                "labels": ["area: Documentation"]
-                },
-            {
-                "area": "Build System",
-                "regex" : ["^cmake/", "^CMakeLists.txt"],
-                "counter": 0,
-                "labels": ["area: Build System"]
-                },
-            {
-                "area": "Kconfig",
-                "regex" : ["^scripts/kconfig", "^Kconfig", "^Kconfig.zephyr"],
-                "counter": 0,
-                "labels": ["area: Kconfig"]
-                },
-            {
-                "area": "Sanitycheck",
-                "regex" : ["^scripts/sanitycheck", "^scripts/sanity_chk"],
-                "counter": 0,
-                "labels": ["area: Sanitycheck"]
-                },
-            {
-                "area": "Manifest",
-                "regex" : ["^west.yml"],
-                "counter": 0,
-                "labels": ["area: Modules"]
-                },
-            ]
-    labels = []
-    for f in files:
-        for m in matches:
-            for r in m['regex']:
-                rm = re.match(r, f)
-                if rm:
-                    m['counter'] += 1
-
-    for m in matches:
-        # print("{}: {} files have changed".format(m['area'], m['counter']))
-        if m['counter'] > 0:
-            labels = labels + m['labels']
+    # Indices of the rules that matched some file, and their labels. Labels
+    # are collected as rules hit, so that the loop can stop as soon as the
+    # outcome is known.
+    hit = set()
+    labels = set()
+    for f in git_records("diff", "-z", "--name-only", "--no-renames",
+                         "--diff-filter=ACMRTD", args.commits):
+        n_hit = len(hit)
+
+        children = TRIE
+        for component in f.split("/", TRIE_DEPTH)[:-1]:
+            node = children.get(component)
+            if node is None:
+                break
+            rules, children = node
+            hit.update(rules)
+
+        if f.startswith(PREFIXES):
+            for n in PREFIX_LENGTHS:
+                if n > len(f):
+                    break
+                hit.update(PREFIX_RULES.get(f[:n], ()))
+
+        if f.endswith(SUFFIXES):
+            for suffix, rules in SUFFIX_RULES.items():
+                if f.endswith(suffix):
+                    hit.update(rules)
+
+        for substring, rules in SUBSTRING_RULES.items():
+            if substring in f:
+                hit.update(rules)
+
+        if len(hit) != n_hit:
+            # A set, so that rules sharing a label can't trip MAX_LABELS
+            labels.update(label for i in hit for label in RULE_LABELS[i])
+
+            if len(labels) > MAX_LABELS or len(hit) == len(RULE_AREAS):
+                # Either we're aborting anyway, or every rule has matched.
+                # The remaining files can't change the outcome.
+                break
+
+    labels = sorted(labels)
 
     print("Labels to apply: {}".format(", ".join(labels)))
-    if len(labels)>10:
+    if len(labels) > MAX_LABELS:
         print("too many labels, aborting...")
         exit(0)
 
+    if not labels:
+        # Nothing to post. Don't touch GitHub.
+        return
+
     if args.pull_request and args.repo:
-        github_token = os.environ['GH_TOKEN']
+        github_token = os.environ.get('GH_TOKEN')
+        if not github_token:
+            sys.exit("GH_TOKEN must be set to post labels to GitHub")
+
+        # Imported here since PyGithub is slow to import, and dry runs
+        # without --repo/--pull-request don't need it
+        from github import Github
         github_conn = Github(github_token)
 
         repo = github_conn.get_repo(args.repo)
 
+        existing = repo_labels(args.repo, github_token)
         post_labels = []
-        gh_pr = repo.get_pull(args.pull_request)
-        for l in labels:
-            repo_label = repo.get_label(l)
-            if repo_label:
-                post_labels.append(repo_label)
-                gh_pr.add_to_labels(repo_label)
+        for label in labels:
+            if label in existing:
+                post_labels.append(label)
+            else:
+                print("label '{}' not found in {}, skipping"
+                      .format(label, args.repo))
+
+        if not post_labels:
+            # Posting an empty list would clear the labels on the PR
+            return
 
+        # add_to_labels() takes label names too, so all labels go out in a
+        # single request, without looking each one up first
+        gh_pr = repo.get_pull(args.pull_request)
+        gh_pr.add_to_labels(*post_labels)
 
 
 if __name__ == "__main__":